@@ -67,45 +67,50 @@ for i, (a, b) in enumerate(bracket_r1):
 
 # ЯЧЕЙКА 3: Сбор рейтингов
 
-ratings_data = []
-for name, username in players.items():
-    url = f"https://api.chess.com/pub/player/{username}/stats"
-    headers = {"User-Agent": "SpeedChessPredictor/1.0"}
-    resp = requests.get(url, headers=headers)
-    
-    if resp.status_code == 200:
-        stats = resp.json()
-        row = {
-            "name": name,
-            "username": username,
-            "bullet_rating": stats.get("chess_bullet", {}).get("last", {}).get("rating"),
-            "bullet_best": stats.get("chess_bullet", {}).get("best", {}).get("rating"),
-            "blitz_rating": stats.get("chess_blitz", {}).get("last", {}).get("rating"),
-            "blitz_best": stats.get("chess_blitz", {}).get("best", {}).get("rating"),
-            "rapid_rating": stats.get("chess_rapid", {}).get("last", {}).get("rating"),
-        }
-        ratings_data.append(row)
-        print(f"✓ {name}")
-    else:
-        print(f"✗ {name} — error {resp.status_code}")
-    time.sleep(0.5)
-
-# Добавляем Firouzja вручную (API возвращает 404)
-ratings_data.append({
-    "name": "Alireza Firouzja",
-    "username": "Firouzja2003",
-    "bullet_rating": 3309,
-    "bullet_best": 3360,
-    "blitz_rating": 3250,
-    "blitz_best": 3315,
-    "rapid_rating": None,
-})
-
-df_ratings = pd.DataFrame(ratings_data)
-df_ratings.to_csv("../data/players_ratings.csv", index=False)
-
-print(f"\n✅ Рейтинги собраны для {len(df_ratings)} игроков:\n")
-print(df_ratings[["name", "blitz_rating", "bullet_rating"]].to_string(index=False))
+# Фичи считаются по рейтингам из партий (ЯЧЕЙКА 6), снимок из /stats
+# для модели не нужен. Включите, чтобы выгрузить его в players_ratings.csv.
+FETCH_LIVE_STATS = False
+
+if FETCH_LIVE_STATS:
+    ratings_data = []
+    for name, username in players.items():
+        url = f"https://api.chess.com/pub/player/{username}/stats"
+        headers = {"User-Agent": "SpeedChessPredictor/1.0"}
+        resp = requests.get(url, headers=headers)
+    
+        if resp.status_code == 200:
+            stats = resp.json()
+            row = {
+                "name": name,
+                "username": username,
+                "bullet_rating": stats.get("chess_bullet", {}).get("last", {}).get("rating"),
+                "bullet_best": stats.get("chess_bullet", {}).get("best", {}).get("rating"),
+                "blitz_rating": stats.get("chess_blitz", {}).get("last", {}).get("rating"),
+                "blitz_best": stats.get("chess_blitz", {}).get("best", {}).get("rating"),
+                "rapid_rating": stats.get("chess_rapid", {}).get("last", {}).get("rating"),
+            }
+            ratings_data.append(row)
+            print(f"✓ {name}")
+        else:
+            print(f"✗ {name} — error {resp.status_code}")
+        time.sleep(0.5)
+
+    # Добавляем Firouzja вручную (API возвращает 404)
+    ratings_data.append({
+        "name": "Alireza Firouzja",
+        "username": "Firouzja2003",
+        "bullet_rating": 3309,
+        "bullet_best": 3360,
+        "blitz_rating": 3250,
+        "blitz_best": 3315,
+        "rapid_rating": None,
+    })
+
+    df_ratings = pd.DataFrame(ratings_data)
+    df_ratings.to_csv("../data/players_ratings.csv", index=False)
+
+    print(f"\n✅ Рейтинги собраны для {len(df_ratings)} игроков:\n")
+    print(df_ratings[["name", "blitz_rating", "bullet_rating"]].to_string(index=False))
 
 
 # ЯЧЕЙКА 4: Сбор истории партий
@@ -244,25 +249,161 @@ for player_a, player_b in bracket_r1:
 
 # ЯЧЕЙКА 6: Feature Engineering (Создание фичей)
 
-def get_rating(name, col):
-    """Получить рейтинг игрока по имени и столбцу"""
-    row = df_ratings[df_ratings["name"] == name]
-    if len(row) == 0:
-        return None
-    return row[col].values[0]
+# --- Инкрементальный рейтинг по истории партий ---
+# Вместо одного снимка из /stats считаем свой Elo: один проход по партиям
+# в хронологическом порядке, O(1) на партию. Рейтинг chess.com из каждой
+# партии служит якорем, наш Elo добавляет поправку за результаты внутри
+# группы. Состояние игроков хранится в массивах [игрок, контроль], индекс
+# игрока — player_id.
+
+TIME_CLASSES = ["blitz", "bullet"]
+tc_to_id = {tc: i for i, tc in enumerate(TIME_CLASSES)}
+
+ELO_K_MAX = 40    # K для игрока без истории (высокая неопределённость, как RD в Glicko)
+ELO_K_MIN = 10    # K для игрока с большой историей
+ELO_K_GAMES = 30  # число партий, за которое K падает до середины диапазона
+ELO_DEFAULT = 1500  # стартовый рейтинг, если в партии рейтинг не указан
+ELO_ANCHOR = 0.5  # доля, на которую Elo после партии подтягивается к рейтингу chess.com
+
+df_games = df_games.sort_values("date", kind="stable").reset_index(drop=True)
 
-def get_h2h_stats(player_a, player_b, time_class=None):
+player_names = list(players.keys()) + sorted(
+    (set(df_games["white"]) | set(df_games["black"])) - set(players.keys())
+)
+player_to_id = {name: i for i, name in enumerate(player_names)}
+n_players = len(player_names)
+n_tc = len(TIME_CLASSES)
+
+white_ids = df_games["white"].map(player_to_id).to_numpy()
+black_ids = df_games["black"].map(player_to_id).to_numpy()
+tc_ids = df_games["time_class"].map(tc_to_id).to_numpy()
+results = df_games["result"].to_numpy(dtype=float)
+dates = df_games["date"].to_numpy(dtype=np.int64)
+# Рейтинг chess.com из архива — это рейтинг ПОСЛЕ партии (результат уже учтён).
+# Он служит стартом и якорем для нашего Elo после обработки партии.
+white_stored = df_games["white_rating"].to_numpy(dtype=float)
+black_stored = df_games["black_rating"].to_numpy(dtype=float)
+
+elo = np.zeros((n_players, n_tc))
+# Максимум нашего Elo по партиям внутри группы (с 2023 г.) — это не
+# рекорд chess.com "best" из /stats, а пик на нашей, более короткой истории
+elo_best = np.zeros((n_players, n_tc))
+games_played = np.zeros((n_players, n_tc), dtype=np.int32)
+
+n_games = len(df_games)
+white_after = np.empty(n_games)
+black_after = np.empty(n_games)
+white_best_after = np.empty(n_games)
+black_best_after = np.empty(n_games)
+
+def elo_k(n):
+    """K-фактор в зависимости от числа сыгранных партий"""
+    return ELO_K_MIN + (ELO_K_MAX - ELO_K_MIN) * ELO_K_GAMES / (ELO_K_GAMES + n)
+
+for i in range(n_games):
+    w, b, t = white_ids[i], black_ids[i], tc_ids[i]
+
+    # Первая партия игрока в этом контроле — рейтинга до неё нет, берём
+    # рейтинг из партии (отличается от рейтинга до неё на одну партию).
+    # 0 — значение API по умолчанию, NaN — пустая ячейка в h2h_games.csv
+    if games_played[w, t] == 0:
+        seed = white_stored[i] if white_stored[i] > 0 else ELO_DEFAULT
+        elo[w, t] = elo_best[w, t] = seed
+    if games_played[b, t] == 0:
+        seed = black_stored[i] if black_stored[i] > 0 else ELO_DEFAULT
+        elo[b, t] = elo_best[b, t] = seed
+
+    expected_w = 1 / (1 + 10**((elo[b, t] - elo[w, t]) / 400))
+    delta = results[i] - expected_w
+    elo[w, t] += elo_k(games_played[w, t]) * delta
+    elo[b, t] -= elo_k(games_played[b, t]) * delta
+    games_played[w, t] += 1
+    games_played[b, t] += 1
+
+    # После партии подтягиваем Elo к рейтингу chess.com после этой партии:
+    # внутри группы партий мало, и без якоря рейтинг отстаёт на месяцы
+    if white_stored[i] > 0:
+        elo[w, t] += ELO_ANCHOR * (white_stored[i] - elo[w, t])
+    if black_stored[i] > 0:
+        elo[b, t] += ELO_ANCHOR * (black_stored[i] - elo[b, t])
+
+    elo_best[w, t] = max(elo_best[w, t], elo[w, t])
+    elo_best[b, t] = max(elo_best[b, t], elo[b, t])
+
+    white_after[i], black_after[i] = elo[w, t], elo[b, t]
+    white_best_after[i], black_best_after[i] = elo_best[w, t], elo_best[b, t]
+
+# История рейтинга: каждая партия даёт два события (белые и чёрные).
+# Сортируем события по (игрок, контроль, номер партии) — внутри каждого
+# отрезка [history_start, history_end) даты идут по возрастанию.
+ev_player = np.concatenate([white_ids, black_ids])
+ev_tc = np.concatenate([tc_ids, tc_ids])
+ev_game = np.concatenate([np.arange(n_games), np.arange(n_games)])
+order = np.lexsort((ev_game, ev_tc, ev_player))
+
+history_date = np.concatenate([dates, dates])[order]
+history_rating = np.concatenate([white_after, black_after])[order]
+history_best = np.concatenate([white_best_after, black_best_after])[order]
+
+ev_key = (ev_player * n_tc + ev_tc)[order]
+all_keys = np.arange(n_players * n_tc)
+history_start = np.searchsorted(ev_key, all_keys, side="left").reshape(n_players, n_tc)
+history_end = np.searchsorted(ev_key, all_keys, side="right").reshape(n_players, n_tc)
+
+def rating_as_of(name, time_class, as_of=None, best=False):
+    """
+    Рейтинг игрока в контроле time_class на момент as_of (unix time).
+
+    Учитываются только партии строго до as_of, as_of=None — текущий рейтинг.
+    best=True — лучший рейтинг на этот момент.
+    Если до as_of в этом контроле партий не было, берётся рейтинг в другом
+    контроле на ту же дату. Если нет и его — NaN (XGBoost считает это пропуском).
+    """
+    p = player_to_id.get(name)
+    if p is None:
+        return np.nan
+
+    # Сначала нужный контроль, затем остальные (блиц ↔ буллет)
+    t = tc_to_id[time_class]
+    for tc in [t] + [o for o in range(n_tc) if o != t]:
+        lo, hi = history_start[p, tc], history_end[p, tc]
+        if as_of is not None:
+            hi = lo + np.searchsorted(history_date[lo:hi], as_of, side="left")
+        if hi > lo:
+            return float((history_best if best else history_rating)[hi - 1])
+    return np.nan
+
+print(f"✅ Рейтинги посчитаны по {n_games} партиям для {n_players} игроков")
+
+def get_rating(name, col, as_of=None):
+    """
+    Получить рейтинг игрока по имени и столбцу на момент as_of.
+
+    Поддерживаются "blitz_rating", "blitz_best", "bullet_rating", "bullet_best"
+    (рапид в df_games не собирается), для остальных столбцов — NaN.
+    "*_best" — максимум нашего Elo по партиям внутри группы до as_of,
+    а не рекорд chess.com за всё время, как раньше в df_ratings.
+    """
+    time_class, _, kind = col.partition("_")
+    if time_class not in tc_to_id or kind not in ("rating", "best"):
+        return np.nan
+    return rating_as_of(name, time_class, as_of, best=(kind == "best"))
+
+def get_h2h_stats(player_a, player_b, time_class=None, as_of=None):
     """
     Получить статистику h2h между двумя игроками.
     
     Возвращает: (wins_a, draws, wins_b, total_games)
     
     time_class: "blitz", "bullet", или None (все)
+    as_of: учитывать только партии строго до этой даты, None — все
     """
     if time_class:
         games = df_games[df_games["time_class"] == time_class]
     else:
         games = df_games
+    if as_of is not None:
+        games = games[games["date"] < as_of]
     
     ab = games[(games["white"] == player_a) & (games["black"] == player_b)]
     # B белые, A чёрные
@@ -275,26 +416,28 @@ def get_h2h_stats(player_a, player_b, time_class=None):
     
     return a_wins, draws, b_wins, total
 
-def build_match_features(player_a, player_b):
+def build_match_features(player_a, player_b, as_of=None):
     """
     Создать вектор фичей для матча player_a vs player_b.
     
+    as_of: дата (unix time), на которую берутся рейтинги и h2h, None — текущие
+    
     Возвращает словарь с фичами.
     """
     # Рейтинги
-    blitz_a = get_rating(player_a, "blitz_rating")
-    blitz_b = get_rating(player_b, "blitz_rating")
-    bullet_a = get_rating(player_a, "bullet_rating")
-    bullet_b = get_rating(player_b, "bullet_rating")
-    blitz_best_a = get_rating(player_a, "blitz_best")
-    blitz_best_b = get_rating(player_b, "blitz_best")
-    bullet_best_a = get_rating(player_a, "bullet_best")
-    bullet_best_b = get_rating(player_b, "bullet_best")
+    blitz_a = get_rating(player_a, "blitz_rating", as_of)
+    blitz_b = get_rating(player_b, "blitz_rating", as_of)
+    bullet_a = get_rating(player_a, "bullet_rating", as_of)
+    bullet_b = get_rating(player_b, "bullet_rating", as_of)
+    blitz_best_a = get_rating(player_a, "blitz_best", as_of)
+    blitz_best_b = get_rating(player_b, "blitz_best", as_of)
+    bullet_best_a = get_rating(player_a, "bullet_best", as_of)
+    bullet_best_b = get_rating(player_b, "bullet_best", as_of)
     
     # H2H статистика
-    h2h_blitz = get_h2h_stats(player_a, player_b, "blitz")
-    h2h_bullet = get_h2h_stats(player_a, player_b, "bullet")
-    h2h_all = get_h2h_stats(player_a, player_b)
+    h2h_blitz = get_h2h_stats(player_a, player_b, "blitz", as_of)
+    h2h_bullet = get_h2h_stats(player_a, player_b, "bullet", as_of)
+    h2h_all = get_h2h_stats(player_a, player_b, as_of=as_of)
     
     # Winrate A в h2h (если есть партии)
     def winrate(wins_a, draws, wins_b, total):
@@ -311,14 +454,16 @@ def build_match_features(player_a, player_b):
         "player_b": player_b,
         
         # Разницы рейтингов (A - B). Положительное = A сильнее.
-        "blitz_diff": (blitz_a or 0) - (blitz_b or 0),
-        "bullet_diff": (bullet_a or 0) - (bullet_b or 0),
-        "blitz_best_diff": (blitz_best_a or 0) - (blitz_best_b or 0),
-        "bullet_best_diff": (bullet_best_a or 0) - (bullet_best_b or 0),
+        # Рейтинг может быть NaN (нет данных) — тогда и фича NaN, а не ±3000
+        "blitz_diff": blitz_a - blitz_b,
+        "bullet_diff": bullet_a - bullet_b,
+        # *_best — пик нашего Elo внутри группы, не рекорд chess.com
+        "blitz_best_diff": blitz_best_a - blitz_best_b,
+        "bullet_best_diff": bullet_best_a - bullet_best_b,
         
         # Средний рейтинг (показывает общий уровень матча)
-        "avg_blitz": ((blitz_a or 0) + (blitz_b or 0)) / 2,
-        "avg_bullet": ((bullet_a or 0) + (bullet_b or 0)) / 2,
+        "avg_blitz": (blitz_a + blitz_b) / 2,
+        "avg_bullet": (bullet_a + bullet_b) / 2,
         
         # H2H winrate (от 0 до 1, где 1 = A всегда побеждает)
         "h2h_winrate_blitz": wr_blitz,
@@ -332,8 +477,8 @@ def build_match_features(player_a, player_b):
         
         # ELO expected score (формула из шахмат)
         # E = 1 / (1 + 10^((Rb - Ra)/400))
-        "elo_expected_blitz": 1 / (1 + 10**((( blitz_b or 0) - (blitz_a or 0))/400)),
-        "elo_expected_bullet": 1 / (1 + 10**(((bullet_b or 0) - (bullet_a or 0))/400)),
+        "elo_expected_blitz": 1 / (1 + 10**((blitz_b - blitz_a)/400)),
+        "elo_expected_bullet": 1 / (1 + 10**((bullet_b - bullet_a)/400)),
     }
     
     return features
@@ -358,7 +503,8 @@ for _, game in df_games.iterrows():
     white = game["white"]
     black = game["black"]
     
-    features = build_match_features(white, black)
+    # Рейтинги и h2h только по партиям до этой — без заглядывания в будущее
+    features = build_match_features(white, black, as_of=game["date"])
     features["result"] = game["result"]  # 1, 0, или 0.5
     features["time_class"] = game["time_class"]
     